@@ -2,24 +2,54 @@
 """
 マカレン数秘術 プロファイル生成 Webアプリ
 """
+import asyncio
+import atexit
+import functools
+import hashlib
 import os
 import re
-import random
+import secrets
 import unicodedata
 import json
+import queue
 import smtplib
+import sqlite3
+import threading
+import time
 import logging
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from email.message import EmailMessage
 from pathlib import Path
 from datetime import datetime, timezone
 from datetime import date
-from threading import Thread
-from flask import Flask, request, jsonify, render_template, send_file
+from threading import Lock, Thread
+from flask import Flask, Response, request, jsonify, render_template
 from dotenv import load_dotenv
+import numerology as num
 import profile_generator as pg
 import pdf_generator as pdfgen
 import io
 
+# JSONL履歴の読み書きは行数に比例してパースコストがかかるため、
+# C/Rust実装の orjson があればそちらを使う（無ければ標準 json にフォールバック）
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
+if _orjson is not None:
+    _json_loads = _orjson.loads
+
+    def _jsonl_line(record: dict) -> bytes:
+        return _orjson.dumps(record) + b"\n"
+else:
+    _json_loads = json.loads
+
+    def _jsonl_line(record: dict) -> bytes:
+        return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
 load_dotenv()
 
 logging.basicConfig(
@@ -40,6 +70,20 @@ SUBMISSIONS_FILE = DATA_DIR / "submissions.jsonl"
 AMBASSADORS_FILE = DATA_DIR / "ambassadors.json"
 AMBASSADOR_EARNINGS_FILE = DATA_DIR / "ambassador_earnings.jsonl"
 AMBASSADOR_REWARD_RATE = 0.10
+INDEX_DB_FILE = DATA_DIR / "index.db"
+
+# ジョブ用ワーカープール（2段パイプライン）。
+# 生成ステージ（LLM呼び出し）と配送ステージ（PDF作成・SMTP送信・記録）を
+# 別プールに分けることで、前のジョブの配送と次のジョブのLLM待ちが重なり、
+# スループットが単一ステージのボトルネックに律速されない。
+GEN_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("GEN_WORKERS", os.getenv("JOB_WORKERS", "4"))),
+    thread_name_prefix="genjob",
+)
+DELIVER_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("DELIVER_WORKERS", "4")),
+    thread_name_prefix="deliver",
+)
 
 # 商品ごとの合計金額（プロファイル＋関係性追加料金）
 def _order_amount(product: str) -> int:
@@ -60,12 +104,53 @@ def health():
     return "", 200
 
 
+@app.route("/healthz")
+def healthz():
+    """待機中ジョブ数つきのヘルスチェック（監視用）。"""
+    gen_pending = GEN_POOL._work_queue.qsize()
+    deliver_pending = DELIVER_POOL._work_queue.qsize()
+    return jsonify(
+        {
+            "ok": True,
+            "pending_jobs": gen_pending + deliver_pending,
+            "pending_generate_jobs": gen_pending,
+            "pending_deliver_jobs": deliver_pending,
+        }
+    )
+
+
+# テンプレート入力が定数のページのレンダリング結果キャッシュ（key -> (etag, bytes)）
+_PAGE_CACHE: dict[str, tuple[str, bytes]] = {}
+_PAGE_CACHE_LOCK = Lock()
+
+
+def _cached_page(cache_key: str, render) -> Response:
+    """入力が定数のページを初回だけレンダリングし、以後はバイト列を使い回す。
+
+    ETag を付けて返し、If-None-Match が一致すれば 304 で応答する。
+    """
+    entry = _PAGE_CACHE.get(cache_key)
+    if entry is None:
+        with _PAGE_CACHE_LOCK:
+            entry = _PAGE_CACHE.get(cache_key)
+            if entry is None:
+                body = render().encode("utf-8")
+                entry = (hashlib.md5(body).hexdigest(), body)
+                _PAGE_CACHE[cache_key] = entry
+    etag, body = entry
+    if request.if_none_match and etag in request.if_none_match:
+        return Response(status=304)
+    resp = Response(body, mimetype="text/html")
+    resp.set_etag(etag)
+    return resp
+
+
 @app.route("/")
 def index():
     t3 = PRICE_PROFILE_ONLY + PRICE_RELATIONSHIP_3
     t5 = PRICE_PROFILE_ONLY + PRICE_RELATIONSHIP_5
     t10 = PRICE_PROFILE_ONLY + PRICE_RELATIONSHIP_10
-    return render_template(
+    return _cached_page("index", lambda: render_template(
         "index.html",
         price_profile=PRICE_PROFILE_ONLY,
         price_r3=PRICE_RELATIONSHIP_3,
@@ -78,25 +163,25 @@ def index():
         total_r3_display=f"{t3:,}",
         total_r5_display=f"{t5:,}",
         total_r10_display=f"{t10:,}",
-    )
+    ))
 
 
 @app.route("/thanks")
 def thanks():
     """送信完了後のサンキューページ。"""
-    return render_template("thanks.html")
+    return _cached_page("thanks", lambda: render_template("thanks.html"))
 
 
 @app.route("/name-guide")
 def name_guide():
     """名前をローマ字にする方法の説明ページ。"""
-    return render_template("name_guide.html")
+    return _cached_page("name_guide", lambda: render_template("name_guide.html"))
 
 
 @app.route("/lp")
 def lp():
     """マカレン数理構造分析のランディングページ。"""
-    return render_template("lp.html")
+    return _cached_page("lp", lambda: render_template("lp.html"))
 
 
 # UNFASHION オークション商品一覧（unfashion8.com 用）
@@ -133,15 +218,35 @@ def shop():
     )
 
 
+# 入力正規化用の正規表現（呼び出しごとの re キャッシュ参照を避ける）
+_WS_RE = re.compile(r"\s+")
+_FILENAME_RE = re.compile(r"[^0-9A-Za-z_\-]+", re.ASCII)
+
+# メールアドレスの局所部・ドメイン部で許可する文字（正規表現を使わない検証用）
+_EMAIL_LOCAL_CHARS = frozenset(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789._%+-"
+)
+_EMAIL_DOMAIN_CHARS = frozenset(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789.-"
+)
+
+
 def _normalize_text(value: str) -> str:
-    """全角/半角ゆれを吸収して前後空白を除去する。"""
-    return unicodedata.normalize("NFKC", str(value or "")).strip()
+    """全角/半角ゆれを吸収して前後空白を除去する。
+
+    入力が純ASCII（機械入力のメール・日付など大半のケース）なら
+    NFKC正規化の表引きを丸ごとスキップする。
+    """
+    s = str(value or "").strip()
+    if s.isascii():
+        return s
+    return unicodedata.normalize("NFKC", s).strip()
 
 
 def _normalize_name(value: str) -> str:
     """姓名入力を正規化（全角->半角、連続空白圧縮、大文字化）。"""
     normalized = _normalize_text(value)
-    normalized = re.sub(r"\s+", " ", normalized)
+    normalized = _WS_RE.sub(" ", normalized)
     return normalized.upper()
 
 
@@ -152,23 +257,37 @@ def _normalize_birth_date(value: str) -> str:
 
 
 def _normalize_email(value: str) -> str:
-    return _normalize_text(value).lower()
+    s = str(value or "").strip()
+    if s.isascii():
+        return s.lower()
+    return _normalize_text(s).lower()
 
 
 def _is_valid_email(value: str) -> bool:
-    if not value:
+    """メールアドレスの簡易検証。正規表現を使わず文字列操作だけで判定する。"""
+    if not value or not value.isascii():
+        return False
+    at = value.find("@")
+    if at < 1 or at != value.rfind("@"):
+        return False
+    local, domain = value[:at], value[at + 1:]
+    base, dot, tld = domain.rpartition(".")
+    if not dot or not base or len(tld) < 2 or not tld.isalpha():
+        return False
+    if not all(c in _EMAIL_LOCAL_CHARS for c in local):
         return False
-    return bool(re.match(r"^[A-Za-z0-9._%+\-]+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,}$", value))
+    return all(c in _EMAIL_DOMAIN_CHARS for c in domain)
+
+
+# Markdown記号（** / ## / ---）を1パスで除去するためのパターン
+_MD_STRIP_RE = re.compile(r"\*\*|##|---")
 
 
 def _strip_markdown(text: str) -> str:
     """モデル出力からMarkdown記号を取り除く。"""
     if not text:
         return ""
-    cleaned = str(text)
-    for pat in ("**", "##", "---"):
-        cleaned = cleaned.replace(pat, "")
-    return cleaned
+    return _MD_STRIP_RE.sub("", str(text))
 
 
 def _guess_smtp_config(smtp_user: str) -> tuple[str, int, bool, bool] | None:
@@ -190,67 +309,296 @@ def _guess_smtp_config(smtp_user: str) -> tuple[str, int, bool, bool] | None:
     return None
 
 
-def _append_submission(record: dict):
+# 申込・報酬の検索用 SQLite 索引。JSONL は監査ログとして残しつつ、
+# 一覧・集計はここから引く（履歴が増えても /admin が線形に遅くならないように）。
+_DB_LOCAL = threading.local()
+_DB_INIT_LOCK = Lock()
+_DB_INITIALIZED = False
+
+_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY,
+    sent_at TEXT,
+    email TEXT,
+    referral_code_issued TEXT,
+    product TEXT,
+    has_relationship INTEGER,
+    raw TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_submissions_email ON submissions(email);
+CREATE INDEX IF NOT EXISTS idx_submissions_referral ON submissions(referral_code_issued);
+CREATE TABLE IF NOT EXISTS earnings (
+    id INTEGER PRIMARY KEY,
+    at TEXT,
+    ambassador_email TEXT,
+    referee_email TEXT,
+    order_amount INTEGER,
+    reward_amount INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_earnings_ambassador ON earnings(ambassador_email);
+"""
+
+
+def _insert_submission_row(conn: sqlite3.Connection, record: dict, raw: str) -> None:
+    conn.execute(
+        "INSERT INTO submissions (sent_at, email, referral_code_issued, product, has_relationship, raw)"
+        " VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            record.get("sent_at") or "",
+            (record.get("email") or "").strip().lower(),
+            (record.get("referral_code_issued") or "").strip(),
+            record.get("product") or "",
+            1 if record.get("has_relationship") else 0,
+            raw,
+        ),
+    )
+
+
+def _insert_earning_row(conn: sqlite3.Connection, record: dict) -> None:
+    conn.execute(
+        "INSERT INTO earnings (at, ambassador_email, referee_email, order_amount, reward_amount)"
+        " VALUES (?, ?, ?, ?, ?)",
+        (
+            record.get("at") or "",
+            (record.get("ambassador_email") or "").strip().lower(),
+            (record.get("referee_email") or "").strip().lower(),
+            int(record.get("order_amount") or 0),
+            int(record.get("reward_amount") or 0),
+        ),
+    )
+
+
+def _iter_jsonl(path: Path):
+    """JSONLファイルの各行を dict で返す（壊れた行はスキップ）。"""
+    if not path.exists():
+        return
+    with path.open("rb") as f:
+        for raw in f:
+            ln = raw.strip()
+            if not ln:
+                continue
+            try:
+                yield _json_loads(ln)
+            except ValueError:
+                continue
+
+
+def _backfill_db(conn: sqlite3.Connection) -> None:
+    """既存のJSONL履歴を索引DBに一度だけ取り込む。"""
+    if conn.execute("SELECT 1 FROM submissions LIMIT 1").fetchone() is None:
+        for record in _iter_jsonl(SUBMISSIONS_FILE):
+            _insert_submission_row(conn, record, json.dumps(record, ensure_ascii=False))
+    if conn.execute("SELECT 1 FROM earnings LIMIT 1").fetchone() is None:
+        for record in _iter_jsonl(AMBASSADOR_EARNINGS_FILE):
+            _insert_earning_row(conn, record)
+    conn.commit()
+
+
+def _db() -> sqlite3.Connection:
+    """スレッドごとの索引DB接続を返す（初回にスキーマ作成とJSONL取り込みを行う）。"""
+    global _DB_INITIALIZED
+    conn = getattr(_DB_LOCAL, "conn", None)
+    if conn is not None:
+        return conn
     DATA_DIR.mkdir(parents=True, exist_ok=True)
-    with SUBMISSIONS_FILE.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    conn = sqlite3.connect(str(INDEX_DB_FILE))
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with _DB_INIT_LOCK:
+        if not _DB_INITIALIZED:
+            conn.executescript(_DB_SCHEMA)
+            _backfill_db(conn)
+            _DB_INITIALIZED = True
+    _DB_LOCAL.conn = conn
+    return conn
+
+
+# 追記用の長寿命ファイルディスクリプタ。イベントごとの open/close を省き、
+# 1件の追記を os.write 1回（syscall 1回）で済ませる。
+_APPEND_FDS: dict[str, int] = {}
+_APPEND_FD_LOCK = Lock()
+
+
+def _append_fd(path: Path) -> int:
+    """追記専用の長寿命fdを返す（初回のみ O_APPEND で開く）。"""
+    key = str(path)
+    fd = _APPEND_FDS.get(key)
+    if fd is not None:
+        return fd
+    with _APPEND_FD_LOCK:
+        fd = _APPEND_FDS.get(key)
+        if fd is None:
+            DATA_DIR.mkdir(parents=True, exist_ok=True)
+            fd = os.open(key, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            _APPEND_FDS[key] = fd
+    return fd
+
+
+@atexit.register
+def _close_append_fds() -> None:
+    for fd in _APPEND_FDS.values():
+        try:
+            os.close(fd)
+        except OSError:
+            pass
 
 
-def _read_submissions(limit: int = 200) -> list[dict]:
-    if not SUBMISSIONS_FILE.exists():
+# 紹介コード索引（submissions.jsonl の全走査を避けるためのプロセス内キャッシュ）。
+# mtime/size で鮮度を判定し、追記分だけを取り込む。_REFERRAL_INDEX_LOCK で保護する。
+_REFERRAL_INDEX: dict = {"mtime": 0.0, "size": 0, "codes": set(), "code_to_email": {}}
+_REFERRAL_INDEX_LOCK = Lock()
+
+
+def _index_referral_record(record: dict) -> None:
+    """紹介コード索引に1レコード分を反映する（ロック取得済みで呼ぶこと）。"""
+    code = (record.get("referral_code_issued") or "").strip()
+    if code and len(code) == 7 and code.isdigit():
+        _REFERRAL_INDEX["codes"].add(code)
+        _REFERRAL_INDEX["code_to_email"][code] = (record.get("email") or "").strip()
+
+
+def _refresh_referral_index_locked() -> None:
+    """submissions.jsonl の変更を索引に取り込む（ロック取得済みで呼ぶこと）。
+
+    前回より大きくなっていれば追記分だけを読み、縮んでいれば全再構築する。
+    """
+    try:
+        st = SUBMISSIONS_FILE.stat()
+    except OSError:
+        _REFERRAL_INDEX.update(mtime=0.0, size=0, codes=set(), code_to_email={})
+        return
+    if st.st_mtime == _REFERRAL_INDEX["mtime"] and st.st_size == _REFERRAL_INDEX["size"]:
+        return
+    start = _REFERRAL_INDEX["size"] if st.st_size >= _REFERRAL_INDEX["size"] else 0
+    if start == 0:
+        _REFERRAL_INDEX["codes"] = set()
+        _REFERRAL_INDEX["code_to_email"] = {}
+    with SUBMISSIONS_FILE.open("rb") as f:
+        f.seek(start)
+        for raw in f:
+            ln = raw.strip()
+            if not ln:
+                continue
+            try:
+                _index_referral_record(_json_loads(ln))
+            except ValueError:
+                continue
+    _REFERRAL_INDEX["mtime"] = st.st_mtime
+    _REFERRAL_INDEX["size"] = st.st_size
+
+
+def _append_submission(record: dict, line: bytes | None = None):
+    """申込履歴を1件追記する。line を渡すと直列化済みバイト列をそのまま書く。"""
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    if line is None:
+        line = _jsonl_line(record)
+    # 先にDB接続を確立して初回のJSONL取り込みを済ませておく
+    # （追記後に取り込みが走ると同じレコードが二重登録されるため）
+    conn = None
+    try:
+        conn = _db()
+    except sqlite3.Error:
+        logger.exception("[db] 索引DBの初期化に失敗しました（JSONLには記録します）")
+    with _REFERRAL_INDEX_LOCK:
+        # 他プロセスが追記した分を先に取り込んでから書く
+        _refresh_referral_index_locked()
+        os.write(_append_fd(SUBMISSIONS_FILE), line)
+        _index_referral_record(record)
+        try:
+            st = SUBMISSIONS_FILE.stat()
+            _REFERRAL_INDEX["mtime"] = st.st_mtime
+            _REFERRAL_INDEX["size"] = st.st_size
+        except OSError:
+            pass
+    if conn is not None:
+        try:
+            _insert_submission_row(conn, record, line.decode("utf-8").rstrip("\n"))
+            conn.commit()
+        except sqlite3.Error:
+            logger.exception("[db] submissions への INSERT に失敗しました（JSONLには記録済み）")
+
+
+def _tail_lines(path: Path, n: int, block_size: int = 8192) -> list[str]:
+    """ファイル末尾の n 行を返す。
+
+    末尾からブロック単位で逆方向に読み、必要な行数が揃った時点で止めるので、
+    履歴がどれだけ増えても I/O とメモリは O(n・平均行長) で済む。
+    """
+    if n <= 0 or not path.exists():
         return []
-    with SUBMISSIONS_FILE.open("r", encoding="utf-8") as f:
-        lines = [ln.strip() for ln in f if ln.strip()]
+    buf = bytearray()
+    with path.open("rb") as f:
+        f.seek(0, io.SEEK_END)
+        pos = f.tell()
+        while pos > 0 and buf.count(b"\n") <= n:
+            blk = min(block_size, pos)
+            pos -= blk
+            f.seek(pos)
+            buf[:0] = f.read(blk)
+    lines = [ln.decode("utf-8", errors="replace").strip() for ln in buf.splitlines()]
+    return [ln for ln in lines if ln][-n:]
+
+
+def _read_submissions_jsonl(limit: int = 200) -> list[dict]:
+    """索引DBが使えない場合のフォールバック（JSONL末尾だけを読む）。"""
     rows = []
-    for ln in lines[-max(1, min(limit, 1000)):]:
+    for ln in _tail_lines(SUBMISSIONS_FILE, max(1, min(limit, 1000))):
         try:
-            rows.append(json.loads(ln))
-        except json.JSONDecodeError:
+            rows.append(_json_loads(ln))
+        except ValueError:
             continue
     rows.reverse()
     return rows
 
 
-def _existing_referral_codes_and_owners() -> tuple[set[str], dict[str, str]]:
-    """発行済み紹介コード一覧と、コード→紹介者メールの対応を返す。"""
-    codes = set()
-    code_to_email: dict[str, str] = {}
-    if not SUBMISSIONS_FILE.exists():
-        return codes, code_to_email
-    with SUBMISSIONS_FILE.open("r", encoding="utf-8") as f:
-        for ln in f:
-            ln = ln.strip()
-            if not ln:
-                continue
+def _read_submissions(limit: int = 200) -> list[dict]:
+    limit = max(1, min(limit, 1000))
+    try:
+        cur = _db().execute(
+            "SELECT raw FROM submissions ORDER BY id DESC LIMIT ?", (limit,)
+        )
+        rows = []
+        for (raw,) in cur:
             try:
-                r = json.loads(ln)
-                c = (r.get("referral_code_issued") or "").strip()
-                if c and len(c) == 7 and c.isdigit():
-                    codes.add(c)
-                    code_to_email[c] = (r.get("email") or "").strip()
-            except json.JSONDecodeError:
+                rows.append(_json_loads(raw))
+            except ValueError:
                 continue
-    return codes, code_to_email
+        return rows
+    except sqlite3.Error:
+        logger.exception("[db] submissions の SELECT に失敗しました。JSONLから読み直します")
+        return _read_submissions_jsonl(limit=limit)
 
 
 def _generate_referral_code() -> str:
-    """重複しないランダム7桁の紹介コードを発行する。"""
-    existing, _ = _existing_referral_codes_and_owners()
-    for _ in range(100):
-        code = str(random.randint(1000000, 9999999))
-        if code not in existing:
-            return code
-    return str(random.randint(1000000, 9999999))
+    """重複しないランダム7桁の紹介コードを発行する。
+
+    CSPRNG（secrets）で引くため、random のシード状態からコードを推測されない。
+    10^7 通りに対して現実的な発行数なら衝突はほぼ起きないので、
+    キャッシュ済み索引との照合を数回試すだけで十分。
+    """
+    with _REFERRAL_INDEX_LOCK:
+        _refresh_referral_index_locked()
+        existing = _REFERRAL_INDEX["codes"]
+        for _ in range(8):
+            code = str(secrets.randbelow(9_000_000) + 1_000_000)
+            if code not in existing:
+                return code
+    return str(secrets.randbelow(9_000_000) + 1_000_000)
 
 
 def _referrer_email_by_code(code: str) -> str | None:
     """紹介コードから紹介者メールを取得。"""
-    _, code_to_email = _existing_referral_codes_and_owners()
-    return code_to_email.get((code or "").strip()) or None
+    with _REFERRAL_INDEX_LOCK:
+        _refresh_referral_index_locked()
+        return _REFERRAL_INDEX["code_to_email"].get((code or "").strip()) or None
 
 
-def _read_ambassadors() -> list[str]:
-    """承認済みアンバサダーのメール一覧（非公開）。"""
+# アンバサダー一覧のプロセス内キャッシュ（mtimeが変わらない限り再読込しない）
+_AMBASSADOR_CACHE: dict = {"mtime": None, "emails": [], "set": frozenset()}
+_AMBASSADOR_CACHE_LOCK = Lock()
+
+
+def _load_ambassadors_file() -> list[str]:
     if not AMBASSADORS_FILE.exists():
         return []
     try:
@@ -262,8 +610,55 @@ def _read_ambassadors() -> list[str]:
         return []
 
 
+def _refresh_ambassador_cache_locked() -> None:
+    try:
+        mtime = AMBASSADORS_FILE.stat().st_mtime
+    except OSError:
+        mtime = None
+    if mtime == _AMBASSADOR_CACHE["mtime"]:
+        return
+    emails = _load_ambassadors_file()
+    _AMBASSADOR_CACHE["mtime"] = mtime
+    _AMBASSADOR_CACHE["emails"] = emails
+    _AMBASSADOR_CACHE["set"] = frozenset(emails)
+
+
+def _read_ambassadors() -> list[str]:
+    """承認済みアンバサダーのメール一覧（非公開）。"""
+    with _AMBASSADOR_CACHE_LOCK:
+        _refresh_ambassador_cache_locked()
+        return list(_AMBASSADOR_CACHE["emails"])
+
+
 def _is_ambassador(email: str) -> bool:
-    return _normalize_email(email) in _read_ambassadors()
+    with _AMBASSADOR_CACHE_LOCK:
+        _refresh_ambassador_cache_locked()
+        return _normalize_email(email) in _AMBASSADOR_CACHE["set"]
+
+
+def _write_ambassadors(emails: list[str]) -> None:
+    """アンバサダー一覧をファイルに書き、キャッシュも即時更新する。
+
+    一時ファイルに書いてから os.replace で差し替えるので、
+    書き込み途中にクラッシュしても一覧が欠損しない。
+    """
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    with _AMBASSADOR_CACHE_LOCK:
+        tmp = AMBASSADORS_FILE.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(
+                {"emails": emails, "updated_at": datetime.now(timezone.utc).isoformat()},
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+        os.replace(tmp, AMBASSADORS_FILE)
+        try:
+            _AMBASSADOR_CACHE["mtime"] = AMBASSADORS_FILE.stat().st_mtime
+        except OSError:
+            _AMBASSADOR_CACHE["mtime"] = None
+        _AMBASSADOR_CACHE["emails"] = list(emails)
+        _AMBASSADOR_CACHE["set"] = frozenset(emails)
 
 
 def _append_ambassador_earning(ambassador_email: str, referee_email: str, order_amount: int):
@@ -277,8 +672,20 @@ def _append_ambassador_earning(ambassador_email: str, referee_email: str, order_
         "order_amount": order_amount,
         "reward_amount": reward,
     }
-    with AMBASSADOR_EARNINGS_FILE.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    conn = None
+    try:
+        conn = _db()
+    except sqlite3.Error:
+        logger.exception("[db] 索引DBの初期化に失敗しました（JSONLには記録します）")
+    fd = _append_fd(AMBASSADOR_EARNINGS_FILE)
+    with _APPEND_FD_LOCK:
+        os.write(fd, _jsonl_line(record))
+    if conn is not None:
+        try:
+            _insert_earning_row(conn, record)
+            conn.commit()
+        except sqlite3.Error:
+            logger.exception("[db] earnings への INSERT に失敗しました（JSONLには記録済み）")
 
 
 def _admin_key_ok() -> bool:
@@ -289,7 +696,10 @@ def _admin_key_ok() -> bool:
 
 
 
+@functools.lru_cache(maxsize=1)
 def _resolve_smtp_settings() -> tuple[dict | None, str | None]:
+    """SMTP設定を環境変数から解決する。環境はプロセス起動後に変わらないため、
+    初回に解決した結果をそのまま使い回す。"""
     smtp_host = os.getenv("SMTP_HOST", "").strip()
     smtp_port = int(os.getenv("SMTP_PORT", "587"))
     smtp_user = os.getenv("SMTP_USER", "").strip()
@@ -325,11 +735,121 @@ def _resolve_smtp_settings() -> tuple[dict | None, str | None]:
     )
 
 
-def _email_subject_and_body(product: str, name: str) -> tuple[str, str]:
-    """プラン別のメール件名と本文を返す。"""
-    if product == "relationship_3":
-        subject = "3名相性鑑定の結果をお届けいたしました"
-        body = (
+# 非同期SMTP（あれば使う）。専用イベントループ上で接続を使い回し、
+# DATA転送のネットワーク待ちでワーカースレッドを塞がない。
+try:
+    import aiosmtplib
+except ImportError:
+    aiosmtplib = None
+
+# 認証済みSMTP接続のプール。TLSハンドシェイク＋AUTH往復が送信時間の大半を
+# 占めるため、接続を使い回して1通ごとの接続コストをなくす。
+_SMTP_POOL: queue.Queue = queue.Queue(maxsize=int(os.getenv("SMTP_POOL_SIZE", "4")))
+_SMTP_POOL_TTL_SECONDS = 300.0
+_SMTP_REAPER_STARTED = False
+_SMTP_REAPER_LOCK = Lock()
+
+
+def _smtp_connect(settings: dict) -> smtplib.SMTP:
+    """SMTP接続を張り、TLS・認証まで済ませて返す。"""
+    if settings["smtp_use_ssl"]:
+        server = smtplib.SMTP_SSL(settings["smtp_host"], settings["smtp_port"], timeout=30)
+    else:
+        server = smtplib.SMTP(settings["smtp_host"], settings["smtp_port"], timeout=30)
+        if settings["smtp_use_tls"]:
+            server.starttls()
+    server.login(settings["smtp_user"], settings["smtp_password"])
+    return server
+
+
+def _close_smtp_quietly(server: smtplib.SMTP) -> None:
+    try:
+        server.quit()
+    except Exception:
+        pass
+
+
+def _pop_pooled_smtp() -> smtplib.SMTP | None:
+    """プールから期限内の接続を取り出す。期限切れは閉じて捨てる。"""
+    while True:
+        try:
+            server, expires_at = _SMTP_POOL.get_nowait()
+        except queue.Empty:
+            return None
+        if time.monotonic() < expires_at:
+            return server
+        _close_smtp_quietly(server)
+
+
+def _smtp_reaper_loop() -> None:
+    """アイドルのまま期限切れになったSMTP接続を定期的に閉じる。"""
+    while True:
+        time.sleep(60)
+        keep = []
+        while True:
+            try:
+                item = _SMTP_POOL.get_nowait()
+            except queue.Empty:
+                break
+            if time.monotonic() < item[1]:
+                keep.append(item)
+            else:
+                _close_smtp_quietly(item[0])
+        for item in keep:
+            try:
+                _SMTP_POOL.put_nowait(item)
+            except queue.Full:
+                _close_smtp_quietly(item[0])
+
+
+def _start_smtp_reaper() -> None:
+    global _SMTP_REAPER_STARTED
+    if _SMTP_REAPER_STARTED:
+        return
+    with _SMTP_REAPER_LOCK:
+        if _SMTP_REAPER_STARTED:
+            return
+        Thread(target=_smtp_reaper_loop, daemon=True, name="smtp-reaper").start()
+        _SMTP_REAPER_STARTED = True
+
+
+@contextmanager
+def _get_smtp(settings: dict):
+    """認証済みSMTP接続を貸し出すコンテキストマネージャ。
+
+    プールに生きた接続があればそれを使い、なければ新規に接続する。
+    正常終了時は NOOP で生存確認してからプールに戻し、
+    例外時・プール満杯時・不健康な接続は閉じて捨てる。
+    """
+    _start_smtp_reaper()
+    server = _pop_pooled_smtp()
+    if server is None:
+        server = _smtp_connect(settings)
+    try:
+        yield server
+    except Exception:
+        _close_smtp_quietly(server)
+        raise
+    healthy = False
+    try:
+        code, _ = server.noop()
+        healthy = code == 250
+    except Exception:
+        healthy = False
+    if healthy:
+        try:
+            _SMTP_POOL.put_nowait((server, time.monotonic() + _SMTP_POOL_TTL_SECONDS))
+            return
+        except queue.Full:
+            pass
+    _close_smtp_quietly(server)
+
+
+# プラン別のメール件名・本文（固定文面なので起動時に一度だけ組み立てる）
+_EMAIL_TEMPLATES: dict[str, tuple[str, str]] = {
+    "relationship_3": (
+        "3名相性鑑定の結果をお届けいたしました",
+        (
             "このたびは、3名相性鑑定をご依頼いただきありがとうございます。\n"
             "結果をお送りいたしました。 それぞれの関係性について、何か感じるものがあれば幸いです。\n\n"
             "3名という範囲で見ると、ひとつひとつの関係の輪郭がはっきりします。 同時に、人間関係には「流れ」があることにも気づかれるかもしれません。\n"
@@ -341,10 +861,11 @@ def _email_subject_and_body(product: str, name: str) -> tuple[str, str]:
             "――\n"
             "マカレン数秘術\n"
             "KIMURA KENJI\n"
-        )
-    elif product == "relationship_5":
-        subject = "5名相性鑑定の結果をお届けいたしました"
-        body = (
+        ),
+    ),
+    "relationship_5": (
+        "5名相性鑑定の結果をお届けいたしました",
+        (
             "このたびは、5名相性鑑定をご依頼いただきありがとうございます。 じっくりと向き合ってくださったこと、嬉しく思います。\n"
             "鑑定結果をお送りいたしました。\n\n"
             "5名という人数になると、単なる相性を超えて、 ひとつのパターンが見えてくることがあります。\n"
@@ -357,10 +878,11 @@ def _email_subject_and_body(product: str, name: str) -> tuple[str, str]:
             "――\n"
             "マカレン数秘術\n"
             "KIMURA KENJI\n"
-        )
-    elif product == "relationship_10":
-        subject = "10名相性鑑定の結果をお届けいたしました"
-        body = (
+        ),
+    ),
+    "relationship_10": (
+        "10名相性鑑定の結果をお届けいたしました",
+        (
             "このたびは、10名相性鑑定をご依頼いただきありがとうございます。 これだけの関係性に真剣に向き合おうとされる姿勢に、深く敬意を表します。\n"
             "鑑定結果をお送りいたしました。\n\n"
             "10名という人数を俯瞰すると、 人間関係がひとつの「地図」のように見えてくることがあります。\n"
@@ -373,11 +895,11 @@ def _email_subject_and_body(product: str, name: str) -> tuple[str, str]:
             "――\n"
             "マカレン数秘術\n"
             "KIMURA KENJI\n"
-        )
-    else:
-        # profile_only
-        subject = "鑑定結果をお届けいたしました"
-        body = (
+        ),
+    ),
+    "profile_only": (
+        "鑑定結果をお届けいたしました",
+        (
             "このたびは、マカレン数秘術をご利用いただきありがとうございます。\n"
             "鑑定結果をお送りいたしました。 どうぞお時間のあるときに、お読みいただければ幸いです。\n\n"
             "自分自身の数字を知ると、ふとしたときに気づくことがあります。 なぜこのタイミングで、あの人のことが気になったのか。 どうしてこの関係に、特別な何かを感じるのか。\n"
@@ -389,8 +911,75 @@ def _email_subject_and_body(product: str, name: str) -> tuple[str, str]:
             "――\n"
             "マカレン数秘術\n"
             "KIMURA KENJI\n"
+        ),
+    ),
+}
+
+
+# aiosmtplib 用: イベントループと (host, port, user) ごとの接続キャッシュ
+_ASYNC_SMTP: dict = {"loop": None, "conns": {}}
+_ASYNC_SMTP_LOCK = Lock()
+
+
+def _async_smtp_loop() -> asyncio.AbstractEventLoop:
+    """SMTP送信専用のイベントループ（デーモンスレッドで常駐）を返す。"""
+    with _ASYNC_SMTP_LOCK:
+        loop = _ASYNC_SMTP["loop"]
+        if loop is None or loop.is_closed():
+            loop = asyncio.new_event_loop()
+            Thread(target=loop.run_forever, daemon=True, name="smtp-async").start()
+            _ASYNC_SMTP["loop"] = loop
+        return loop
+
+
+async def _async_send(msg: EmailMessage, settings: dict) -> None:
+    """接続キャッシュを使って1通送る。切断されていた接続は捨てて張り直す。"""
+    key = (settings["smtp_host"], settings["smtp_port"], settings["smtp_user"])
+    smtp = _ASYNC_SMTP["conns"].get(key)
+    if smtp is None or not smtp.is_connected:
+        smtp = aiosmtplib.SMTP(
+            hostname=settings["smtp_host"],
+            port=settings["smtp_port"],
+            use_tls=settings["smtp_use_ssl"],
+            start_tls=settings["smtp_use_tls"] and not settings["smtp_use_ssl"],
+            timeout=30,
+        )
+        await smtp.connect()
+        await smtp.login(settings["smtp_user"], settings["smtp_password"])
+        _ASYNC_SMTP["conns"][key] = smtp
+    try:
+        await smtp.send_message(msg)
+    except aiosmtplib.errors.SMTPServerDisconnected:
+        _ASYNC_SMTP["conns"].pop(key, None)
+        raise
+
+
+def _smtp_send(msg: EmailMessage, settings: dict) -> None:
+    """1通送信する。aiosmtplib があれば専用ループ上の共有接続で送り、
+    なければ同期プール（_get_smtp）で送る。"""
+    if aiosmtplib is not None:
+        future = asyncio.run_coroutine_threadsafe(
+            _async_send(msg, settings), _async_smtp_loop()
         )
-    return subject, body
+        future.result(timeout=120)
+        return
+    with _get_smtp(settings) as server:
+        server.send_message(msg)
+
+
+# 「切断されていたので張り直してもう一度」を判定する例外型
+if aiosmtplib is not None:
+    _SMTP_DISCONNECTED_ERRORS: tuple = (
+        smtplib.SMTPServerDisconnected,
+        aiosmtplib.errors.SMTPServerDisconnected,
+    )
+else:
+    _SMTP_DISCONNECTED_ERRORS = (smtplib.SMTPServerDisconnected,)
+
+
+def _email_subject_and_body(product: str, name: str) -> tuple[str, str]:
+    """プラン別のメール件名と本文を返す（未知のプランは profile_only 扱い）。"""
+    return _EMAIL_TEMPLATES.get(product) or _EMAIL_TEMPLATES["profile_only"]
 
 
 def _send_profile_email(
@@ -443,7 +1032,7 @@ def _send_profile_email(
     msg["From"] = smtp_settings["smtp_from"]
     msg["To"] = email_to
     msg.set_content(body)
-    safe_name = re.sub(r"[^0-9A-Za-z_\-]+", "_", name) or "profile"
+    safe_name = _FILENAME_RE.sub("_", name) or "profile"
     msg.add_attachment(
         pdf_bytes,
         maintype="application",
@@ -451,34 +1040,8 @@ def _send_profile_email(
         filename=f"makaren_profile_{safe_name}.pdf",
     )
 
-    try:
-        logger.info(
-            "[send_email] 送信開始 email=%s from=%s host=%s port=%s product=%s",
-            email_to,
-            smtp_settings["smtp_from"],
-            smtp_settings["smtp_host"],
-            smtp_settings["smtp_port"],
-            product,
-        )
-        if smtp_settings["smtp_use_ssl"]:
-            with smtplib.SMTP_SSL(
-                smtp_settings["smtp_host"], smtp_settings["smtp_port"], timeout=30
-            ) as server:
-                server.login(smtp_settings["smtp_user"], smtp_settings["smtp_password"])
-                server.send_message(msg)
-        else:
-            with smtplib.SMTP(
-                smtp_settings["smtp_host"], smtp_settings["smtp_port"], timeout=30
-            ) as server:
-                if smtp_settings["smtp_use_tls"]:
-                    server.starttls()
-                server.login(smtp_settings["smtp_user"], smtp_settings["smtp_password"])
-                server.send_message(msg)
-        logger.info("[send_email] 送信完了 email=%s product=%s", email_to, product)
-    except Exception as e:
-        logger.exception("[send_email] メール送信エラー email=%s product=%s", email_to, product)
-        return False, f"メール送信に失敗しました: {e}"
-
+    # 送信記録はソケット送信前に直列化まで済ませておき、
+    # 送信完了後は write 1回の追記だけで済むようにする
     record = {
         "sent_at": datetime.now(timezone.utc).isoformat(),
         "name": name,
@@ -494,7 +1057,28 @@ def _send_profile_email(
         record["referred_by"] = referred_by
     if others_list:
         record["others"] = [{"name_display": o.get("name_display") or "", "birth_date": o.get("birth_date") or ""} for o in others_list]
-    _append_submission(record)
+    record_line = _jsonl_line(record)
+
+    try:
+        logger.info(
+            "[send_email] 送信開始 email=%s from=%s host=%s port=%s product=%s",
+            email_to,
+            smtp_settings["smtp_from"],
+            smtp_settings["smtp_host"],
+            smtp_settings["smtp_port"],
+            product,
+        )
+        try:
+            _smtp_send(msg, smtp_settings)
+        except _SMTP_DISCONNECTED_ERRORS:
+            # 使い回していた接続がサーバー側で切られていた場合は一度だけやり直す
+            _smtp_send(msg, smtp_settings)
+        logger.info("[send_email] 送信完了 email=%s product=%s", email_to, product)
+    except Exception as e:
+        logger.exception("[send_email] メール送信エラー email=%s product=%s", email_to, product)
+        return False, f"メール送信に失敗しました: {e}"
+
+    _append_submission(record, line=record_line)
     logger.info("[send_email] 送信記録を保存しました email=%s product=%s", email_to, product)
     return True, None
 
@@ -509,10 +1093,18 @@ def _parse_birth_date(birth_date: str):
     """
     if not birth_date:
         return None, None, None
-    m = re.match(r"^\s*(\d{4})[/-](\d{1,2})[/-](\d{1,2})\s*$", birth_date)
-    if not m:
+    s = birth_date.strip()
+    if not s.isascii():
+        return None, None, None
+    parts = s.replace("-", "/").split("/")
+    if len(parts) != 3:
+        return None, None, None
+    ys, ms, ds = parts
+    if not (ys.isdigit() and ms.isdigit() and ds.isdigit()):
         return None, None, None
-    y, month, day = map(int, m.groups())
+    if len(ys) != 4 or len(ms) > 2 or len(ds) > 2:
+        return None, None, None
+    y, month, day = int(ys), int(ms), int(ds)
     if y < 1900 or y > 2100:
         return None, None, None
     try:
@@ -542,8 +1134,6 @@ def _run_generate_job(
         product,
     )
     try:
-        import numerology as num
-
         y, m, d = _parse_birth_date(birth_date)
         if y is None or m is None or d is None:
             return
@@ -565,26 +1155,8 @@ def _run_generate_job(
                 "そのテーマへのガイダンスも併せて含めてください。"
             )
 
-        profile_text = pg.generate_profile(
-            last_name,
-            first_name,
-            birth_date,
-            consultation_for_llm,
-            numbers,
-            nine_year_cycle,
-            maiden_last_name=maiden_last_name or None,
-            numbers_maiden=numbers_maiden,
-        )
-        profile_text = _strip_markdown(profile_text)
-
-        result: dict = {
-            "ok": True,
-            "profile": profile_text,
-            "product": product,
-            "numbers": numbers,
-            "nine_year_cycle": nine_year_cycle,
-            "name": name_display,
-        }
+        # 関係性分析の対象者はLLM呼び出しの前に整形しておく。
+        # プロファイルと関係性分析は互いに依存しないので、両方必要な場合は並行生成する。
         others_for_record: list[dict] = []
 
         max_others = 0
@@ -619,60 +1191,70 @@ def _run_generate_job(
                 {"name_display": o.get("name_display") or "", "birth_date": o.get("birth_date") or ""}
                 for o in others
             ]
-            if others:
-                relation_text = pg.generate_relationship_analysis(
-                    name_display, birth_date, numbers, others
-                )
-                relation_text = _strip_markdown(relation_text)
-                result["relationship"] = relation_text
-            else:
-                result["relationship"] = None
         else:
-            result["relationship"] = None
+            others = []
+
+        if others:
+            profile_text, relation_text = pg.generate_profile_and_relationship(
+                last_name,
+                first_name,
+                birth_date,
+                consultation_for_llm,
+                numbers,
+                nine_year_cycle,
+                name_display,
+                others,
+                maiden_last_name=maiden_last_name or None,
+                numbers_maiden=numbers_maiden,
+            )
+            profile_text = _strip_markdown(profile_text)
+            relation_text = _strip_markdown(relation_text)
+        else:
+            profile_text = pg.generate_profile(
+                last_name,
+                first_name,
+                birth_date,
+                consultation_for_llm,
+                numbers,
+                nine_year_cycle,
+                maiden_last_name=maiden_last_name or None,
+                numbers_maiden=numbers_maiden,
+            )
+            profile_text = _strip_markdown(profile_text)
+            relation_text = None
+
+        result: dict = {
+            "ok": True,
+            "profile": profile_text,
+            "product": product,
+            "numbers": numbers,
+            "nine_year_cycle": nine_year_cycle,
+            "name": name_display,
+            "relationship": relation_text,
+        }
 
-        # 紹介コード発行（メール送信時のみ履歴に残す）
-        referral_code_issued = ""
         referred_by = (
             referred_by_code
             if (referred_by_code and len(referred_by_code) == 7 and referred_by_code.isdigit())
             else None
         )
         if email_to:
-            referral_code_issued = _generate_referral_code()
-            order_amount = _order_amount(product)
-            # 通常ユーザー: 紹介者への金銭報酬なし。アンバサダーのみ非公開で報酬を記録。
-            if referred_by:
-                referrer_email = _referrer_email_by_code(referred_by)
-                if referrer_email and referrer_email != email_to and _is_ambassador(referrer_email):
-                    _append_ambassador_earning(referrer_email, email_to, order_amount)
-            sent_ok, sent_err = _send_profile_email(
-                profile=profile_text,
-                relationship=result.get("relationship") or "",
-                name=name_display,
-                email_to=email_to,
-                product=product,
-                birth_date=birth_date,
-                consultation=consultation,
-                numbers=numbers,
-                nine_year_cycle=nine_year_cycle,
-                referral_code_issued=referral_code_issued,
-                referred_by=referred_by,
-                others_list=others_for_record,
+            # 生成が済んだらPDF作成〜送信は配送プールに渡し、
+            # このワーカーを次のLLM呼び出しにすぐ空ける
+            DELIVER_POOL.submit(
+                _run_deliver_job,
+                profile_text,
+                result.get("relationship") or "",
+                name_display,
+                email_to,
+                product,
+                birth_date,
+                consultation,
+                numbers,
+                nine_year_cycle,
+                referred_by,
+                others_for_record,
             )
-            if sent_ok:
-                logger.info(
-                    "[generate_job] メール送信成功 email=%s product=%s referral=%s",
-                    email_to,
-                    product,
-                    referral_code_issued or "",
-                )
-            else:
-                logger.error(
-                    "[generate_job] メール送信失敗 email=%s product=%s error=%s",
-                    email_to,
-                    product,
-                    sent_err or "",
-                )
     except Exception:
         import traceback
 
@@ -686,6 +1268,63 @@ def _run_generate_job(
         )
 
 
+def _run_deliver_job(
+    profile_text: str,
+    relationship: str,
+    name_display: str,
+    email_to: str,
+    product: str,
+    birth_date: str,
+    consultation: str,
+    numbers: dict | None,
+    nine_year_cycle: list[dict] | None,
+    referred_by: str | None,
+    others_for_record: list[dict],
+) -> None:
+    """配送ステージ: 紹介コード発行・報酬記録・PDF作成・メール送信・履歴保存。"""
+    try:
+        # 紹介コード発行（メール送信時のみ履歴に残す）
+        referral_code_issued = _generate_referral_code()
+        order_amount = _order_amount(product)
+        # 通常ユーザー: 紹介者への金銭報酬なし。アンバサダーのみ非公開で報酬を記録。
+        if referred_by:
+            referrer_email = _referrer_email_by_code(referred_by)
+            if referrer_email and referrer_email != email_to and _is_ambassador(referrer_email):
+                _append_ambassador_earning(referrer_email, email_to, order_amount)
+        sent_ok, sent_err = _send_profile_email(
+            profile=profile_text,
+            relationship=relationship,
+            name=name_display,
+            email_to=email_to,
+            product=product,
+            birth_date=birth_date,
+            consultation=consultation,
+            numbers=numbers,
+            nine_year_cycle=nine_year_cycle,
+            referral_code_issued=referral_code_issued,
+            referred_by=referred_by,
+            others_list=others_for_record,
+        )
+        if sent_ok:
+            logger.info(
+                "[deliver_job] メール送信成功 email=%s product=%s referral=%s",
+                email_to,
+                product,
+                referral_code_issued or "",
+            )
+        else:
+            logger.error(
+                "[deliver_job] メール送信失敗 email=%s product=%s error=%s",
+                email_to,
+                product,
+                sent_err or "",
+            )
+    except Exception:
+        logger.exception(
+            "[deliver_job] 予期しないエラー email=%s product=%s", email_to, product
+        )
+
+
 @app.route("/api/generate", methods=["POST"])
 def generate():
     """プロファイル生成リクエストを受け取り、バックグラウンドジョブとして処理を実行する。
@@ -728,21 +1367,18 @@ def generate():
         return jsonify({"ok": False, "error": smtp_error}), 500
 
     # バックグラウンドでプロファイル生成〜メール送信まで実行
-    Thread(
-        target=_run_generate_job,
-        args=(
-            last_name,
-            first_name,
-            maiden_last_name,
-            birth_date,
-            consultation,
-            email_to,
-            product,
-            referred_by_code,
-            others,
-        ),
-        daemon=True,
-    ).start()
+    GEN_POOL.submit(
+        _run_generate_job,
+        last_name,
+        first_name,
+        maiden_last_name,
+        birth_date,
+        consultation,
+        email_to,
+        product,
+        referred_by_code,
+        others,
+    )
 
     # フロント側は結果の詳細を使っていないため、即座に成功レスポンスだけ返す
     return jsonify({"ok": True})
@@ -768,12 +1404,14 @@ def download_pdf():
     except Exception as e:
         return jsonify({"ok": False, "error": f"PDFの作成に失敗しました: {e}"}), 500
 
-    return send_file(
-        io.BytesIO(pdf_bytes),
-        mimetype="application/pdf",
-        as_attachment=True,
-        download_name=f"makaren_profile_{name}.pdf",
+    # BytesIO に包んで send_file に渡すとレスポンス生成時にもう1コピー発生するため、
+    # バイト列をそのまま Response に載せる
+    resp = Response(pdf_bytes, mimetype="application/pdf")
+    resp.headers.set(
+        "Content-Disposition", "attachment", filename=f"makaren_profile_{name}.pdf"
     )
+    resp.headers["Content-Length"] = str(len(pdf_bytes))
+    return resp
 
 
 @app.route("/api/send-email", methods=["POST"])
@@ -793,7 +1431,6 @@ def send_email():
     y, m, d = _parse_birth_date(birth_date)
     nine_year_cycle = []
     if y is not None and m is not None and d is not None:
-        import numerology as num  # 局所インポート
         nine_year_cycle = num.compute_nine_year_cycle(y, m, d)
 
     sent_ok, sent_error = _send_profile_email(
@@ -826,45 +1463,90 @@ def list_submissions():
     return jsonify({"ok": True, "items": rows, "count": len(rows)})
 
 
-def _read_ambassador_earnings(limit: int = 5000) -> list[dict]:
-    if not AMBASSADOR_EARNINGS_FILE.exists():
-        return []
+def _read_ambassador_earnings_jsonl(limit: int = 5000) -> list[dict]:
+    """索引DBが使えない場合のフォールバック（JSONL末尾だけを読む）。"""
     rows = []
-    with AMBASSADOR_EARNINGS_FILE.open("r", encoding="utf-8") as f:
-        for ln in f:
-            ln = ln.strip()
-            if not ln:
-                continue
-            try:
-                rows.append(json.loads(ln))
-            except json.JSONDecodeError:
-                continue
+    for ln in _tail_lines(AMBASSADOR_EARNINGS_FILE, max(1, limit)):
+        try:
+            rows.append(_json_loads(ln))
+        except ValueError:
+            continue
     rows.reverse()
-    return rows[:limit]
+    return rows
+
+
+def _read_ambassador_earnings(limit: int = 5000) -> list[dict]:
+    try:
+        cur = _db().execute(
+            "SELECT at, ambassador_email, referee_email, order_amount, reward_amount"
+            " FROM earnings ORDER BY id DESC LIMIT ?",
+            (limit,),
+        )
+        return [
+            {
+                "at": at,
+                "ambassador_email": am,
+                "referee_email": rf,
+                "order_amount": amt,
+                "reward_amount": rew,
+            }
+            for at, am, rf, amt, rew in cur
+        ]
+    except sqlite3.Error:
+        logger.exception("[db] earnings の SELECT に失敗しました。JSONLから読み直します")
+        return _read_ambassador_earnings_jsonl(limit=limit)
+
+
+def _ambassador_stats_jsonl() -> tuple[list[dict], int, int]:
+    """索引DBが使えない場合のフォールバック（JSONLをPythonで集計）。"""
+    refs: Counter = Counter()
+    sales: defaultdict = defaultdict(int)
+    rewards: defaultdict = defaultdict(int)
+    for r in _read_ambassador_earnings_jsonl():
+        em = (r.get("ambassador_email") or "").strip().lower()
+        if not em:
+            continue
+        refs[em] += 1
+        sales[em] += r.get("order_amount") or 0
+        rewards[em] += r.get("reward_amount") or 0
+    by_email: dict[str, dict] = {}
+    for e in _read_ambassadors():
+        by_email[e] = {"email": e, "referral_count": 0, "total_sales": 0, "total_reward": 0}
+    for em in refs:
+        by_email[em] = {
+            "email": em,
+            "referral_count": refs[em],
+            "total_sales": sales[em],
+            "total_reward": rewards[em],
+        }
+    return list(by_email.values()), sum(refs.values()), sum(sales.values())
 
 
 def _ambassador_stats() -> tuple[list[dict], int, int]:
     """アンバサダーごとの紹介数・売上、全体の累計紹介数・累計売上。"""
-    ambassadors = _read_ambassadors()
-    earnings = _read_ambassador_earnings()
+    try:
+        cur = _db().execute(
+            "SELECT ambassador_email, COUNT(*), SUM(order_amount), SUM(reward_amount)"
+            " FROM earnings WHERE ambassador_email != '' GROUP BY ambassador_email"
+        )
+        aggregated = cur.fetchall()
+    except sqlite3.Error:
+        logger.exception("[db] earnings の集計に失敗しました。JSONLから集計し直します")
+        return _ambassador_stats_jsonl()
     by_email: dict[str, dict] = {}
-    for e in ambassadors:
+    for e in _read_ambassadors():
         by_email[e] = {"email": e, "referral_count": 0, "total_sales": 0, "total_reward": 0}
     total_referrals = 0
     total_sales = 0
-    for r in earnings:
-        em = (r.get("ambassador_email") or "").strip().lower()
-        if not em:
-            continue
-        total_referrals += 1
-        amt = r.get("order_amount") or 0
-        rew = r.get("reward_amount") or 0
-        total_sales += amt
-        if em not in by_email:
-            by_email[em] = {"email": em, "referral_count": 0, "total_sales": 0, "total_reward": 0}
-        by_email[em]["referral_count"] += 1
-        by_email[em]["total_sales"] += amt
-        by_email[em]["total_reward"] += rew
+    for em, count, sales, rewards in aggregated:
+        total_referrals += count
+        total_sales += sales or 0
+        by_email[em] = {
+            "email": em,
+            "referral_count": count,
+            "total_sales": sales or 0,
+            "total_reward": rewards or 0,
+        }
     return list(by_email.values()), total_referrals, total_sales
 
 
@@ -920,9 +1602,7 @@ def admin_add_ambassador():
     if email in current:
         return jsonify({"ok": True, "message": "既に登録済みです"})
     current.append(email)
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    with AMBASSADORS_FILE.open("w", encoding="utf-8") as f:
-        json.dump({"emails": current, "updated_at": datetime.now(timezone.utc).isoformat()}, f, ensure_ascii=False, indent=2)
+    _write_ambassadors(current)
     return jsonify({"ok": True, "message": "追加しました"})
 
 
@@ -939,9 +1619,7 @@ def admin_remove_ambassador():
     if email not in current:
         return jsonify({"ok": True, "message": "登録されていません"})
     current = [e for e in current if e != email]
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    with AMBASSADORS_FILE.open("w", encoding="utf-8") as f:
-        json.dump({"emails": current, "updated_at": datetime.now(timezone.utc).isoformat()}, f, ensure_ascii=False, indent=2)
+    _write_ambassadors(current)
     return jsonify({"ok": True, "message": "解除しました"})
 
 
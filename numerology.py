@@ -3,57 +3,137 @@
 マカレン数秘：構成数計算（スプレッドシート用ロジックと同一）
 姓・名はローマ字（A-Z）で与える想定。
 """
+import functools
 import re
 import unicodedata
 
+# numba があれば純整数の縮約ループをネイティブ化する（無くても純Pythonで動作）
+try:
+    from numba import njit as _njit
+except ImportError:
+    _njit = None
+
+
+# 文字→数の変換表（ord で直接引く）。A-Z 以外は 0。
+# 母音・子音だけを数える走査用に、対応する位置だけ値を持つ表も用意する。
+def _build_letter_tables() -> tuple[bytes, bytes, bytes]:
+    all_vals = bytearray(256)
+    vowel_vals = bytearray(256)
+    cons_vals = bytearray(256)
+    for i in range(26):
+        v = (i % 9) + 1
+        upper = chr(65 + i)
+        for c in (65 + i, 97 + i):
+            all_vals[c] = v
+            if upper in "AEIOU":
+                vowel_vals[c] = v
+            else:
+                cons_vals[c] = v
+    return bytes(all_vals), bytes(vowel_vals), bytes(cons_vals)
+
+
+_LETTER_VALS, _VOWEL_VALS, _CONS_VALS = _build_letter_tables()
+
 
 def _letter_to_num(ch: str) -> int:
-    c = ord(ch.upper()) if ch else 0
-    if c < 65 or c > 90:
-        return 0
-    return ((c - 65) % 9) + 1
+    c = ord(ch) if ch else 0
+    return _LETTER_VALS[c] if c < 256 else 0
+
 
+# A-Z と空白以外を除去するパターン（_normalize 用）
+_ASCII_STRIP_RE = re.compile(r"[^A-Z ]")
 
+# 数字以外を除去するパターン（_reduce_keep 用）
+_NON_DIGIT_RE = re.compile(r"[^0-9]")
+
+
+@functools.lru_cache(maxsize=1024)
 def _normalize(s: str) -> str:
     if s is None:
         return ""
-    s = unicodedata.normalize("NFKC", str(s)).upper().strip()
-    s = re.sub(r"[^A-Z ]", "", s)
-    return s.strip()
+    s2 = str(s)
+    if s2.isascii():
+        # ローマ字名はほぼ常にここを通る。ASCIIならNFKCは恒等変換なのでスキップ。
+        return _ASCII_STRIP_RE.sub("", s2.upper().strip()).strip()
+    s2 = unicodedata.normalize("NFKC", s2).upper().strip()
+    return _ASCII_STRIP_RE.sub("", s2).strip()
 
 
-def _reduce_keep(n) -> int | str:
-    """桁和縮約。11/22 は保持。"""
-    if n == "" or n is None:
-        return ""
-    cleaned = re.sub(r"[^0-9]", "", str(n))
-    if not cleaned:
-        return ""
-    x = int(cleaned)
+def _digit_sum(x: int) -> int:
+    """非負整数の桁和。文字列化せず divmod で桁を剥がす。"""
+    total = 0
+    while x:
+        x, r = divmod(x, 10)
+        total += r
+    return total
+
+
+def _reduce_keep_int(x: int) -> int:
+    """非負整数の桁和縮約（11/22 は保持）。純整数演算のみ。"""
     if x == 11 or x == 22:
         return x
     for _ in range(10):
         if x < 10:
             return x
-        x = sum(int(d) for d in str(x))
+        x = _digit_sum(x)
         if x == 11 or x == 22:
             return x
     return x
 
 
+if _njit is not None:
+    # 明示シグネチャ付きでコンパイル（呼び出し側の型推論ブレを防ぐ）
+    _digit_sum = _njit("int64(int64)", cache=True)(_digit_sum)
+    _reduce_keep_int = _njit("int64(int64)", cache=True)(_reduce_keep_int)
+
+
+def _reduce_keep(n) -> int | str:
+    """桁和縮約。11/22 は保持。"""
+    if n == "" or n is None:
+        return ""
+    # 内部の呼び出し元はほぼ常に int を渡すので、正規表現を通さず直行する
+    if isinstance(n, int):
+        return _reduce_keep_int(n if n >= 0 else -n)
+    cleaned = _NON_DIGIT_RE.sub("", str(n))
+    if not cleaned:
+        return ""
+    return _reduce_keep_int(int(cleaned))
+
+
+# _clean 系は正規化済み（A-Zのみ）の文字列を前提とした内部ヘルパー。
+# compute_all が姓・名それぞれ1回だけ正規化し、結果をこれらに渡す。
+
+def _sum_alpha_clean(clean: str) -> int:
+    return sum(_LETTER_VALS[b] for b in clean.encode("ascii", "ignore"))
+
+
+def _sum_vowel_clean(clean: str) -> int:
+    return sum(_VOWEL_VALS[b] for b in clean.encode("ascii", "ignore"))
+
+
+def _sum_cons_clean(clean: str) -> int:
+    return sum(_CONS_VALS[b] for b in clean.encode("ascii", "ignore"))
+
+
+def _sum_vc_clean(clean: str) -> tuple[int, int]:
+    """母音和と子音和を1回の走査でまとめて返す。"""
+    v = c = 0
+    for b in clean.encode("ascii", "ignore"):
+        v += _VOWEL_VALS[b]
+        c += _CONS_VALS[b]
+    return v, c
+
+
 def _sum_alpha(s: str) -> int:
-    s = _normalize(s).replace(" ", "")
-    return sum(_letter_to_num(ch) for ch in s)
+    return _sum_alpha_clean(_normalize(s).replace(" ", ""))
 
 
 def _sum_vowel(s: str) -> int:
-    s = _normalize(s).replace(" ", "")
-    return sum(_letter_to_num(ch) for ch in s if ch in "AEIOU")
+    return _sum_vowel_clean(_normalize(s).replace(" ", ""))
 
 
 def _sum_cons(s: str) -> int:
-    s = _normalize(s).replace(" ", "")
-    return sum(_letter_to_num(ch) for ch in s if ch.isalpha() and ch not in "AEIOU")
+    return _sum_cons_clean(_normalize(s).replace(" ", ""))
 
 
 # ===== 数秘関数（スプレッドシートの NUM_* と対応） =====
@@ -135,34 +215,40 @@ def compute_all(last_name_roma: str, first_name_roma: str, year: int, month: int
     last = last_name_roma or ""
     first = first_name_roma or ""
     y, m, d = int(year or 0), int(month or 0), int(day or 0)
+    # 同一入力での再計算（リトライ・再表示）はキャッシュから辞書を組み立て直すだけ
+    return dict(zip(LABELS, _compute_all_cached(last, first, y, m, d)))
+
+
+@functools.lru_cache(maxsize=512)
+def _compute_all_cached(last: str, first: str, y: int, m: int, d: int) -> tuple[str, ...]:
+    # 正規化（NFKC＋正規表現）は姓・名それぞれ1回だけ行い、
+    # 以降の走査はすべて正規化済み文字列に対して行う
+    last_clean = _normalize(last).replace(" ", "")
+    first_clean = _normalize(first).replace(" ", "")
 
     b11 = num_birth_i(y, m, d)
     b12 = num_birth_ii(d)
-    b14 = num_last_total(last)
-    b15 = num_first_total(first)
+    b14 = _reduce_keep(_sum_alpha_clean(last_clean))
+    b15 = _reduce_keep(_sum_alpha_clean(first_clean))
     b16 = num_social_from_parts(b14, b15)
     b17 = num_mission(b11, b16)
-    b18 = num_soul_full(last, first)
-    b19 = num_look_full(last, first)
+    last_v, last_c = _sum_vc_clean(last_clean)
+    first_v, first_c = _sum_vc_clean(first_clean)
+    b18 = _reduce_keep(last_v + first_v)
+    b19 = _reduce_keep(last_c + first_c)
     b20 = num_stage(b19, m)
-    b21 = num_insu(last, first)
+    b21 = _reduce_keep(
+        (_LETTER_VALS[ord(last_clean[0])] if last_clean else 0)
+        + (_LETTER_VALS[ord(first_clean[0])] if first_clean else 0)
+    )
     b22 = num_core(b11, b18)
     b13 = num_kage(b11, b12)
 
-    return {
-        "誕生数Ⅰ": _fmt(b11),
-        "誕生数Ⅱ": _fmt(b12),
-        "影数": _fmt(b13),
-        "家系数": _fmt(b14),
-        "自我数": _fmt(b15),
-        "社会数": _fmt(b16),
-        "使命数": _fmt(b17),
-        "魂数": _fmt(b18),
-        "外見数": _fmt(b19),
-        "演技数": _fmt(b20),
-        "隠数": _fmt(b21),
-        "核数": _fmt(b22),
-    }
+    # LABELS と同じ並びで返す（compute_all 側で辞書に戻す）
+    return (
+        _fmt(b11), _fmt(b12), _fmt(b13), _fmt(b14), _fmt(b15), _fmt(b16),
+        _fmt(b17), _fmt(b18), _fmt(b19), _fmt(b20), _fmt(b21), _fmt(b22),
+    )
 
 
 def _fmt(v) -> str:
@@ -182,25 +268,23 @@ def _reduce_to_one_digit_for_cycle(n: int) -> int:
             return 2
         if n == 22:
             return 4
-        n = sum(int(d) for d in str(n))
+        n = _digit_sum(n)
     return n if 1 <= n <= 9 else 1
 
 
 # 西暦の桁和（11・22はまとめて1つとして扱う）。例: 2011→2+0+11=13→4, 2022→2+0+22=24→6
 def _year_digit_sum_for_cycle(year: int) -> int:
-    s = str(year)
-    parts: list[int] = []
-    i = 0
-    while i < len(s):
-        if i + 2 <= len(s):
-            two = s[i : i + 2]
-            if two == "11" or two == "22":
-                parts.append(int(two))
-                i += 2
-                continue
-        parts.append(int(s[i]))
-        i += 1
-    total = sum(parts)
+    # 下位から2桁ずつ divmod で剥がす。11/22 はそのまま足し、
+    # それ以外は桁をばらして足す。最終的に1桁へ還元するため結果は
+    # 従来の文字列走査（先頭から貪欲にペア検出）と一致する。
+    total = 0
+    y = int(year)
+    while y:
+        y, pair = divmod(y, 100)
+        if pair == 11 or pair == 22:
+            total += pair
+        else:
+            total += pair // 10 + pair % 10
     return _reduce_to_one_digit_for_cycle(total)
 
 
@@ -243,26 +327,31 @@ def compute_nine_year_cycle(year: int, month: int, day: int, length: int = 9, st
     except (TypeError, ValueError):
         return []
 
-    birth_i_raw = num_birth_i(y, m, d)
-    birth_i = _birth_i_for_cycle(birth_i_raw)
-
     from datetime import date
     if start_year is None:
         # サーバーの現在日付を基準に、現在の年を中心に前後3年（計7年）で分析（例: 2026年なら2023〜2029）
+        # デフォルトの基準年はキャッシュに入る前にここで解決する（日付跨ぎで古い結果を返さないため）
         start_year = date.today().year - 3
         effective_length = 7
     else:
         effective_length = length
 
-    cycles: list[dict] = []
+    return [
+        {"year": ty, "personal_year": py, "meaning": mn}
+        for ty, py, mn in _nine_year_cycle_cached(y, m, d, effective_length, start_year)
+    ]
+
+
+@functools.lru_cache(maxsize=512)
+def _nine_year_cycle_cached(y: int, m: int, d: int, effective_length: int, start_year: int) -> tuple:
+    birth_i_raw = num_birth_i(y, m, d)
+    birth_i = _birth_i_for_cycle(birth_i_raw)
+
+    cycles = []
     for offset in range(effective_length):
         target_year = start_year + offset
         year_sum = _year_digit_sum_for_cycle(target_year)
         personal_num = _reduce_to_one_digit_for_cycle(year_sum + birth_i)
         meaning = NINE_YEAR_MEANINGS.get(personal_num, "")
-        cycles.append({
-            "year": target_year,
-            "personal_year": str(personal_num),
-            "meaning": meaning,
-        })
-    return cycles
+        cycles.append((target_year, str(personal_num), meaning))
+    return tuple(cycles)
@@ -6,9 +6,11 @@ from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import mm
 from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Preformatted, Image, Table, TableStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Image, Table, TableStyle
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
+import functools
+import html
 import io
 import re
 import os
@@ -37,13 +39,20 @@ def _register_japanese_font():
 
 
 _register_japanese_font()
+# 登録結果はプロセス中に変わらないので、解決済みフォント名を定数として持つ
+FONT_NAME_EFFECTIVE = FONT_NAME if _JP_FONT_OK else "Helvetica"
 BASE_DIR = os.path.dirname(__file__)
 IMAGES_DIR = os.path.join(BASE_DIR, "static", "images")
 RELATION_DIAGRAM_PATH = os.path.join(IMAGES_DIR, "diagram_relations.png")
+_RELATION_DIAGRAM_EXISTS = os.path.isfile(RELATION_DIAGRAM_PATH)
+
+# 見出し判定パターン（_text_to_flowables 用）
+_HEADING_HASH_RE = re.compile(r"^#+\s")
+_HEADING_NUM_RE = re.compile(r"^\d+\.\s+.+")
 
 
 def _font_name():
-    return FONT_NAME if _JP_FONT_OK else "Helvetica"
+    return FONT_NAME_EFFECTIVE
 
 
 def _text_to_flowables(
@@ -55,7 +64,7 @@ def _text_to_flowables(
 ) -> list:
     """Markdown風の見出し・改行をFlowableに変換"""
     flowables = []
-    fn = _font_name()
+    fn = FONT_NAME_EFFECTIVE
     body_style = styles.get("MakarenBodyText", styles["Normal"])
     heading_style = ParagraphStyle(
         "Heading",
@@ -83,7 +92,7 @@ def _text_to_flowables(
             # 「7. ９年サイクルの読み解き」のように、
             # 行頭が「数字. 」で始まる見出しはすべてHeadingスタイルに統一する
             is_heading = bool(
-                re.match(r"^#+\s", line) or re.match(r"^\d+\.\s+.+", line)
+                _HEADING_HASH_RE.match(line) or _HEADING_NUM_RE.match(line)
             )
             if is_heading:
                 flowables.append(Paragraph(line.replace("#", "").strip(), heading_style))
@@ -111,17 +120,18 @@ def _text_to_flowables(
                         # 画像読み込みに失敗しても本文生成は続行
                         pass
             else:
-                # 改行を<br/>に
-                line = line.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-                flowables.append(Paragraph(line, body_style))
+                # &・<・> を1パスでエスケープ（quote=False で " はそのまま）
+                flowables.append(Paragraph(html.escape(line, quote=False), body_style))
         flowables.append(Spacer(1, 6))
     return flowables
 
 
+@functools.lru_cache(maxsize=32)
 def _core_image_path(core_value: str | None) -> str | None:
     """
     核数ごとのイメージ画像パスを返す。
     static/images/core_1.png のようなファイルが存在する場合のみ使用。
+    存在チェックの結果はプロセス中キャッシュされる。
     """
     if not core_value:
         return None
@@ -146,7 +156,7 @@ def build_pdf(
         topMargin=20 * mm,
         bottomMargin=20 * mm,
     )
-    fn = _font_name()
+    fn = FONT_NAME_EFFECTIVE
     styles = getSampleStyleSheet()
     styles["Normal"].fontName = fn
     styles["Normal"].fontSize = 10
@@ -203,7 +213,7 @@ def build_pdf(
         table_data = [row1_labels, row1_vals, row2_labels, row2_vals]
         t = Table(table_data, colWidths=[available_width / 5.0] * 5)
         t.setStyle(TableStyle([
-            ("FONTNAME", (0, 0), (-1, -1), _font_name()),
+            ("FONTNAME", (0, 0), (-1, -1), fn),
             ("FONTSIZE", (0, 0), (-1, -1), 9),
             ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#e8e8e8")),
             ("BACKGROUND", (0, 2), (-1, 2), colors.HexColor("#e8e8e8")),
@@ -215,7 +225,7 @@ def build_pdf(
         story.append(Spacer(1, 8))
 
         story.append(Paragraph("構成数の関係性", section_style))
-        if os.path.isfile(RELATION_DIAGRAM_PATH):
+        if _RELATION_DIAGRAM_EXISTS:
             # 1ページ目に確実に収まるよう、図の高さを少し抑える（縦横比は保持）
             diagram_max_height = available_height * 0.45
             story.append(
@@ -234,8 +244,9 @@ def build_pdf(
                 "使命数（役割）はこれら全体を束ねる中心の数としてイメージする。",
                 "隠数は、内面的な構成数から影響を受ける「裏側の動き・弱点」として扱う。",
             ]
-            diagram_text = "\n".join(diagram_lines)
-            story.append(Preformatted(diagram_text, body_style))
+            # Preformatted より Paragraph + <br/> の方がレイアウトが速く、折り返しも効く
+            diagram_text = "<br/>".join(diagram_lines)
+            story.append(Paragraph(diagram_text, body_style))
 
         # 図の下に、画像内の説明テキストをそのまま挿入
         relation_text = (
@@ -250,7 +261,7 @@ def build_pdf(
             "１つひとつの数字を単体で観るのではなく、このように組み合わせて観ていくことが大切。"
         )
         story.append(Spacer(1, 6))
-        story.append(Preformatted(relation_text, body_style))
+        story.append(Paragraph(relation_text.replace("\n", "<br/>"), body_style))
         story.append(Spacer(1, 8))
 
     # 2ページ目以降に９年サイクルと本文
@@ -278,7 +289,7 @@ def build_pdf(
             cycle_table.setStyle(
                 TableStyle(
                     [
-                        ("FONTNAME", (0, 0), (-1, -1), _font_name()),
+                        ("FONTNAME", (0, 0), (-1, -1), fn),
                         ("FONTSIZE", (0, 0), (-1, -1), 9),
                         ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#e8e8e8")),
                         ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
@@ -305,4 +316,6 @@ def build_pdf(
     )
 
     doc.build(story)
-    return buffer.getvalue()
+    # getvalue() は内部バッファの完全コピーを作る。getbuffer() 経由なら
+    # 下層の配列から直接 bytes を1回だけ切り出せる。
+    return bytes(buffer.getbuffer())
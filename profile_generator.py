@@ -2,31 +2,77 @@
 """
 OpenAI (ChatGPT) API を用いたマカレン数秘術プロファイル生成
 """
+import asyncio
 import os
+import threading
 import time
-from openai import OpenAI, APIConnectionError, APITimeoutError, RateLimitError, APIError
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APITimeoutError, RateLimitError, APIError
 from dotenv import load_dotenv
 from prompts import build_system_prompt, build_profile_user_prompt, build_relationship_user_prompt
 
 load_dotenv()
 
 
+# クライアントはプロセス内シングルトン。毎回生成するとHTTPXセッションと
+# TLSコンテキストを作り直し、API呼び出しごとに接続確立からやり直しになる。
+_CLIENT: OpenAI | None = None
+_CLIENT_LOCK = threading.Lock()
+
+
 def get_client():
-    key = os.getenv("OPENAI_API_KEY")
-    if not key:
-        raise ValueError("OPENAI_API_KEY が設定されていません。.env を確認してください。")
-    return OpenAI(api_key=key)
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                key = os.getenv("OPENAI_API_KEY")
+                if not key:
+                    raise ValueError("OPENAI_API_KEY が設定されていません。.env を確認してください。")
+                _CLIENT = OpenAI(api_key=key)
+    return _CLIENT
 
 
-def _create_chat_completion(client: OpenAI, system: str, user: str):
+# 並行生成用: AsyncOpenAI クライアントと専用イベントループ（デーモンスレッドで常駐）。
+# app.py の aiosmtplib と同じ常駐ループ方式。クライアントはループ上でのみ触るためロック不要。
+_ASYNC_CLIENT: AsyncOpenAI | None = None
+_ASYNC_GEN: dict = {"loop": None}
+_ASYNC_GEN_LOCK = threading.Lock()
+
+
+def _async_gen_loop() -> asyncio.AbstractEventLoop:
+    """LLM並行呼び出し専用のイベントループを返す。"""
+    with _ASYNC_GEN_LOCK:
+        loop = _ASYNC_GEN["loop"]
+        if loop is None or loop.is_closed():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, daemon=True, name="llm-async").start()
+            _ASYNC_GEN["loop"] = loop
+        return loop
+
+
+def _get_async_client() -> AsyncOpenAI:
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None:
+        key = os.getenv("OPENAI_API_KEY")
+        if not key:
+            raise ValueError("OPENAI_API_KEY が設定されていません。.env を確認してください。")
+        _ASYNC_CLIENT = AsyncOpenAI(api_key=key)
+    return _ASYNC_CLIENT
+
+
+def _retry_params() -> tuple[float, int]:
     """
-    OpenAI API呼び出し（接続不安定時の簡易リトライ付き）。
     環境変数で調整可:
       - OPENAI_TIMEOUT_SECONDS (default: 120)
       - OPENAI_RETRY_COUNT (default: 3)
     """
     timeout_sec = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "120"))
     retry_count = max(1, int(os.getenv("OPENAI_RETRY_COUNT", "3")))
+    return timeout_sec, retry_count
+
+
+def _create_chat_completion(client: OpenAI, system: str, user: str):
+    """OpenAI API呼び出し（接続不安定時の簡易リトライ付き）。"""
+    timeout_sec, retry_count = _retry_params()
 
     for attempt in range(1, retry_count + 1):
         try:
@@ -53,6 +99,35 @@ def _create_chat_completion(client: OpenAI, system: str, user: str):
             raise RuntimeError(f"OpenAI APIエラー: {e}") from e
 
 
+async def _acreate_chat_completion(client: AsyncOpenAI, system: str, user: str):
+    """_create_chat_completion の非同期版（同じリトライ規則）。"""
+    timeout_sec, retry_count = _retry_params()
+
+    for attempt in range(1, retry_count + 1):
+        try:
+            return await client.chat.completions.create(
+                model="gpt-4o",
+                max_tokens=8192,
+                timeout=timeout_sec,
+                messages=[
+                    {"role": "system", "content": system},
+                    {"role": "user", "content": user},
+                ],
+            )
+        except (APIConnectionError, APITimeoutError) as e:
+            if attempt >= retry_count:
+                raise RuntimeError(
+                    "OpenAIへの接続に失敗しました。ネットワーク状態を確認して、少し時間をおいて再試行してください。"
+                ) from e
+            await asyncio.sleep(min(2 ** (attempt - 1), 4))
+        except RateLimitError as e:
+            raise RuntimeError(
+                "APIの利用上限に達しました。少し待ってから再試行してください。"
+            ) from e
+        except APIError as e:
+            raise RuntimeError(f"OpenAI APIエラー: {e}") from e
+
+
 def generate_profile(
     last_name_roma: str,
     first_name_roma: str,
@@ -81,6 +156,20 @@ def generate_profile(
     return response.choices[0].message.content
 
 
+# 関係性分析のシステムプロンプト（同期・非同期の両経路で共用）
+_RELATIONSHIP_SYSTEM = (
+    "あなたはマカレン数秘術に基づく関係性分析の専門家です。"
+    "ラッキーアイテム・運命論・恐怖を煽る表現は禁止。"
+    "構造的・現実的・運用に活かせる形で、各人物との相性と関係性のヒントを書いてください。"
+    "メインの本人用プロファイルは別途A4約4枚分で作成済みなので、ここでは省略せず、"
+    "各人物との関係性に特化した内容を十分な分量で書いてください。"
+    "1人あたりA4用紙の約半ページ分（日本語でおおよそ800〜1200文字、3〜5段落程度）を目安とし、"
+    "人数が増えればそのぶん全体の分量も増えるようにしてください。"
+    "名前については、与えられたローマ字表記（例: YAMADA, TANAKA など）をそのまま用い、"
+    "漢字や別の表記への推測変換は一切行わないでください。"
+)
+
+
 def generate_relationship_analysis(
     main_name: str, main_birth: str,
     main_numbers: dict,
@@ -88,20 +177,56 @@ def generate_relationship_analysis(
 ) -> str:
     """周囲10人との関係性分析を生成"""
     client = get_client()
-    system = (
-        "あなたはマカレン数秘術に基づく関係性分析の専門家です。"
-        "ラッキーアイテム・運命論・恐怖を煽る表現は禁止。"
-        "構造的・現実的・運用に活かせる形で、各人物との相性と関係性のヒントを書いてください。"
-        "メインの本人用プロファイルは別途A4約4枚分で作成済みなので、ここでは省略せず、"
-        "各人物との関係性に特化した内容を十分な分量で書いてください。"
-        "1人あたりA4用紙の約半ページ分（日本語でおおよそ800〜1200文字、3〜5段落程度）を目安とし、"
-        "人数が増えればそのぶん全体の分量も増えるようにしてください。"
-        "名前については、与えられたローマ字表記（例: YAMADA, TANAKA など）をそのまま用い、"
-        "漢字や別の表記への推測変換は一切行わないでください。"
-    )
     user = build_relationship_user_prompt(
         main_name, main_birth, main_numbers, others
     )
 
-    response = _create_chat_completion(client, system, user)
+    response = _create_chat_completion(client, _RELATIONSHIP_SYSTEM, user)
     return response.choices[0].message.content
+
+
+def generate_profile_and_relationship(
+    last_name_roma: str,
+    first_name_roma: str,
+    birth_date: str,
+    consultation: str,
+    numbers: dict,
+    nine_year_cycle: list[dict] | None,
+    main_name: str,
+    others: list[dict],
+    maiden_last_name: str | None = None,
+    numbers_maiden: dict | None = None,
+) -> tuple[str, str]:
+    """
+    本人用プロファイルと関係性分析を並行生成する。
+    2本のLLM呼び出し（各5〜30秒）は互いに依存しないため、
+    常駐ループ上で asyncio.gather により同時に待つ。
+    返り値: (profile_text, relation_text)
+    """
+    profile_user = build_profile_user_prompt(
+        last_name_roma,
+        first_name_roma,
+        birth_date,
+        consultation,
+        numbers,
+        nine_year_cycle,
+        maiden_last_name=maiden_last_name,
+        numbers_maiden=numbers_maiden,
+    )
+    relation_user = build_relationship_user_prompt(
+        main_name, birth_date, numbers, others
+    )
+
+    async def _both() -> tuple[str, str]:
+        client = _get_async_client()
+        profile_res, relation_res = await asyncio.gather(
+            _acreate_chat_completion(client, build_system_prompt(), profile_user),
+            _acreate_chat_completion(client, _RELATIONSHIP_SYSTEM, relation_user),
+        )
+        return (
+            profile_res.choices[0].message.content,
+            relation_res.choices[0].message.content,
+        )
+
+    future = asyncio.run_coroutine_threadsafe(_both(), _async_gen_loop())
+    return future.result()
@@ -14,6 +14,7 @@ import json
 import re
 import time
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 try:
@@ -23,6 +24,19 @@ except ImportError:
     print("必要なパッケージをインストールしてください: pip install requests beautifulsoup4")
     sys.exit(1)
 
+# lxml があればC実装パーサーを使う（html.parser より数倍速い）。無ければ従来どおり。
+try:
+    import lxml  # noqa: F401
+    BS4_PARSER = "lxml"
+except ImportError:
+    BS4_PARSER = "html.parser"
+
+# orjson があれば出力の直列化に使う（app.py と同じ任意依存の扱い）
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 SELLER_ID = "4XQdPCTXHMTSxfGS6kcu2ab1B3GFN"
 BASE_URL = "https://auctions.yahoo.co.jp/seller/" + SELLER_ID
 PER_PAGE = 50
@@ -34,19 +48,33 @@ HEADERS = {
     "Accept-Language": "ja,en;q=0.9",
 }
 
+# keep-alive で接続を使い回す（ページごとのTLSハンドシェイクを省く）
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+
+# 同時取得するページ数。礼儀として少なめに保つ。
+FETCH_WORKERS = 3
+
+# 商品ごとのループ内で使うパターンはモジュールスコープでコンパイルしておく
+_AUC_ID_RE = re.compile(r"/auc/([a-zA-Z0-9]+)")
+_PRICE_RE = re.compile(r"[¥￥]\s*([0-9,]+)")
+
 
 def fetch_page(b: int) -> str:
     """1ページ分のHTMLを取得。b=1,51,101,..."""
     url = f"{BASE_URL}?fixed=0&b={b}&n={PER_PAGE}&select=23&mode=3"
-    r = requests.get(url, headers=HEADERS, timeout=30)
+    r = SESSION.get(url, timeout=30)
     r.raise_for_status()
     return r.text
 
 
 def parse_items(html: str) -> list[dict]:
     """HTMLから商品リストをパースする。"""
-    soup = BeautifulSoup(html, "html.parser")
+    soup = BeautifulSoup(html, BS4_PARSER)
     items = []
+    # 同じ商品の重複（画像リンク＋タイトルリンクで1カード2アンカーが普通）は
+    # ID判明時点で弾き、重複分の辞書構築・DOM走査ごと省く
+    seen = set()
 
     # 商品リンク (Yahooオークションの商品URL形式)
     for a in soup.select('a[href*="/jp/show/auc/"]'):
@@ -56,22 +84,24 @@ def parse_items(html: str) -> list[dict]:
         if not href.startswith("http"):
             href = "https://auctions.yahoo.co.jp" + href.split("?")[0] if href.startswith("/") else "https://auctions.yahoo.co.jp" + href
         # 同じ商品の重複を避けるため、auction ID をキーにする
-        m = re.search(r"/auc/([a-zA-Z0-9]+)", href)
+        m = _AUC_ID_RE.search(href)
         auc_id = m.group(1) if m else None
-        if not auc_id:
+        if not auc_id or auc_id in seen:
             continue
+        seen.add(auc_id)
+
+        # カード（商品1件分の親要素）は1回だけ特定し、テキスト走査も1回で済ませる
+        card = a.find_parent(["li", "div", "article", "section"])
+        card_text = card.get_text(separator=" ", strip=True) if card else ""
 
         # タイトル: リンクテキストまたは親要素
         title = (a.get_text(strip=True) or "").strip()
         if not title or len(title) < 2:
-            parent = a.find_parent(["div", "li", "section"])
-            if parent:
-                title = (parent.get_text(separator=" ", strip=True) or "").strip()[:200]
+            title = card_text[:200]
         title = title[:200] if title else "（タイトルなし）"
 
         # 画像: 同じカード内の img
         img_url = None
-        card = a.find_parent(["li", "div", "article"])
         if card:
             img = card.select_one("img[src*='yahoo']") or card.select_one("img")
             if img and img.get("src"):
@@ -82,15 +112,14 @@ def parse_items(html: str) -> list[dict]:
         # 価格: 同じカード内の数値
         price = None
         price_text = None
-        if card:
-            text = card.get_text()
-            yen = re.search(r"([¥￥])\s*([0-9,]+)", text)
-            if yen:
-                price_text = "¥" + yen.group(2).replace(",", "")
-                try:
-                    price = int(yen.group(2).replace(",", ""))
-                except ValueError:
-                    pass
+        yen = _PRICE_RE.search(card_text)
+        if yen:
+            digits = yen.group(1).replace(",", "")
+            price_text = "¥" + digits
+            try:
+                price = int(digits)
+            except ValueError:
+                pass
 
         items.append({
             "id": auc_id,
@@ -102,44 +131,78 @@ def parse_items(html: str) -> list[dict]:
             "category": None,
         })
 
-    # 重複除去（id で）
-    seen = set()
-    unique = []
-    for x in items:
-        if x["id"] not in seen:
-            seen.add(x["id"])
-            unique.append(x)
-    return unique
+    return items
+
+
+def _looks_blocked(html: str) -> bool:
+    """レート制限・認証ページらしきレスポンスかどうかの簡易判定。"""
+    return len(html) < 1024 or "captcha" in html.lower() or "認証" in html
 
 
 def main():
     all_items = []
-    page = 1
-    start = 1
+    # ページ間で既出IDを追跡する。末尾ページ同士が重なって新規IDが増えない場合は
+    # リスト末尾に達したとみなして打ち切る
+    global_seen: set = set()
 
     print("UNFASHION 出品一覧を取得しています...")
-    while True:
-        try:
-            html = fetch_page(start)
-            batch = parse_items(html)
-            if not batch:
-                # 1ページ目で取れない場合は終了（JS描画の可能性）
-                if page == 1:
-                    print("商品リストを取得できませんでした。ページがJavaScriptで描画されている可能性があります。")
-                    print("ブラウザで該当ページを開き、開発者ツールでHTML構造を確認するか、")
-                    print("data/unfashion_products.json を手動で編集してください。")
-                break
-                break
-            all_items.extend(batch)
-            print(f"  ページ {page}: {len(batch)} 件 (累計 {len(all_items)} 件)")
-            if len(batch) < PER_PAGE:
-                break
-            start += PER_PAGE
-            page += 1
-            time.sleep(1.5)  # サーバー負荷軽減
-        except requests.RequestException as e:
-            print(f"エラー: {e}")
-            break
+    # 1ページ目は単独で取得して、リストが取れるページかどうかを確認する
+    try:
+        first_html = fetch_page(1)
+    except requests.RequestException as e:
+        print(f"エラー: {e}")
+        first_html = ""
+    if first_html and _looks_blocked(first_html):
+        print("レスポンスが認証ページまたは異常に短い内容です。ブロックされている可能性があるため中断します。")
+        first_html = ""
+    first_batch = parse_items(first_html) if first_html else []
+    if not first_batch:
+        # 1ページ目で取れない場合は終了（JS描画の可能性）
+        if first_html:
+            print("商品リストを取得できませんでした。ページがJavaScriptで描画されている可能性があります。")
+            print("ブラウザで該当ページを開き、開発者ツールでHTML構造を確認するか、")
+            print("data/unfashion_products.json を手動で編集してください。")
+    else:
+        all_items.extend(first_batch)
+        global_seen.update(x["id"] for x in first_batch)
+        print(f"  ページ 1: {len(first_batch)} 件 (累計 {len(all_items)} 件)")
+        done = len(first_batch) < PER_PAGE
+        page = 2
+        start = 1 + PER_PAGE
+        # 2ページ目以降は数ページずつ並行取得（送信は0.5秒ずつずらして負荷を抑える）
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+            while not done:
+                futures = []
+                for i in range(FETCH_WORKERS):
+                    futures.append(pool.submit(fetch_page, start + i * PER_PAGE))
+                    time.sleep(0.5)
+                for fut in futures:
+                    try:
+                        html = fut.result()
+                    except requests.RequestException as e:
+                        print(f"エラー: {e}")
+                        done = True
+                        break
+                    if _looks_blocked(html):
+                        print("レスポンスが認証ページまたは異常に短い内容です。ブロックされている可能性があるため中断します。")
+                        done = True
+                        break
+                    batch = parse_items(html)
+                    fresh = [x for x in batch if x["id"] not in global_seen]
+                    if not fresh:
+                        # 空ページ、または前ページと全件重複＝末尾に到達
+                        done = True
+                        break
+                    all_items.extend(fresh)
+                    global_seen.update(x["id"] for x in fresh)
+                    print(f"  ページ {page}: {len(fresh)} 件 (累計 {len(all_items)} 件)")
+                    page += 1
+                    if len(batch) < PER_PAGE:
+                        done = True
+                        break
+                start += PER_PAGE * FETCH_WORKERS
+                if not done:
+                    time.sleep(1.5)  # サーバー負荷軽減
 
     data = {
         "seller_name": "UNFASHION",
@@ -149,8 +212,12 @@ def main():
         "items": all_items,
     }
     OUTPUT_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with OUTPUT_PATH.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    # 機械が読むデータファイルなので indent なしで書く（サイズ・CPUとも約半分）
+    if orjson is not None:
+        OUTPUT_PATH.write_bytes(orjson.dumps(data))
+    else:
+        with OUTPUT_PATH.open("w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
     print(f"保存しました: {OUTPUT_PATH} ({len(all_items)} 件)")
 
 